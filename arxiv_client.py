@@ -1,15 +1,18 @@
 # arxiv.py
 import logging
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import List, Optional
 from arxiv_llm import PaperAI
 import arxiv  # pip install arxiv
 from arxiv_database import DatabaseManager  # 兼容 PostgreSQL JSON 类型
 import asyncio
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 
-@dataclass
+@dataclass(slots=True)
 class PaperEntry:
     """统一论文数据结构"""
     arxiv_id: str
@@ -33,7 +36,20 @@ class ArxivClient:
     def __init__(self, config: dict, db: DatabaseManager, llm: PaperAI):
         self.max_results = config.get("arxiv", {}).get("max_results", 20)
         self.client = arxiv.Client()
+        # arXiv 请求为阻塞 HTTP，放到单线程的独立线程池中执行；
+        # arxiv.Client 的请求间隔检查不是线程安全的，单线程串行请求才能保证 delay_seconds 间隔
+        self._net_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="arxiv")
+        # 限制同时处理的检索数：arXiv 请求本身串行，各检索的入库与 AI 生成可以重叠
+        self._arxiv_sem = asyncio.Semaphore(config.get("arxiv", {}).get("max_concurrent", 4))
+        # query -> (时间, max_results, 结果)，arXiv 列表更新很慢，短时间内相同检索直接复用
+        self._search_cache: dict[str, tuple[float, int, List[PaperEntry]]] = {}
+        self.search_cache_ttl = config.get("arxiv", {}).get("search_cache_seconds", 3600)
+        # arxiv_id -> 数据库中的 AI 字段 (tags, description, translation)，入库后不再变化，超出上限时淘汰最早的条目
+        self._paper_cache: OrderedDict[str, tuple] = OrderedDict()
+        self.paper_cache_size = 50_000
         self.db = db
+        # 执行同步数据库调用的线程池，None 表示事件循环默认线程池；TgBot 会替换为其数据库线程池
+        self.db_executor = None
         self.llm = llm
 
         logging.basicConfig(level=logging.INFO)
@@ -45,50 +61,72 @@ class ArxivClient:
     async def search(self, query: str, max_results: int = None) -> List[PaperEntry]:
         """根据关键词搜索论文"""
         max_results = max_results or self.max_results
+        cached = self._cached_search(query, max_results)
+        if cached is not None:
+            return cached
         self.logger.info(f"Searching arXiv for query: {query}")
 
-        try:
-            search = arxiv.Search(query=query,
-                                  max_results=max_results,
-                                  sort_by=arxiv.SortCriterion.SubmittedDate,
-                                  sort_order=arxiv.SortOrder.Descending)
-            results = self.client.results(search)
-        except Exception as e:
-            self.logger.error(f"arXiv search failed for query '{query}': {e}")
-            return []
-
-        papers = []
-        new_papers = []
-        for e in results:
-            # 分流处理数据库已有和新论文
-            try:
-                paper = self._entry_to_paper(e)
-                # 检查数据库是否已有
-                if self.db.paper_exists(paper.arxiv_id):
-                    # 从数据库读取 tags, description, translation
-                    db_paper = self.db.get_paper_data(paper.arxiv_id)
-                    paper.tags = db_paper["tags"]
-                    paper.description = db_paper["description"]
-                    paper.translation = db_paper["translation"]
-                else:
-                    new_papers.append(paper)
-                papers.append(paper)  # 无论新旧，都加入返回列表
-            except Exception as ex:
-                self.logger.warning(f"Failed to convert arXiv entry to PaperEntry: {ex}")
-
-        # 异步生成 tags, description, translation，仅对新论文
-        if self.llm and new_papers:
+        search = arxiv.Search(query=query,
+                              max_results=max_results,
+                              sort_by=arxiv.SortCriterion.SubmittedDate,
+                              sort_order=arxiv.SortOrder.Descending)
+        async with self._arxiv_sem:
             try:
-                await self.llm.enrich_papers_batch(new_papers)
+                # arxiv 包为同步阻塞请求，放到线程中执行，避免阻塞事件循环
+                results = await asyncio.get_running_loop().run_in_executor(
+                    self._net_pool, self._fetch_papers, search)
             except Exception as e:
-                self.logger.error(f"LLM enrichment failed: {e}")
+                self.logger.error(f"arXiv search failed for query '{query}': {e}")
+                return []
 
-        # 保存新论文到数据库
-        for p in new_papers:
-            self._save_to_db(p)
+            # 数据库查询为同步阻塞调用，放到线程中执行
+            papers, new_papers, complete = await self._run_db(self._split_known_papers, results)
 
+            # 异步生成 tags, description, translation，仅对新论文
+            if self.llm and new_papers:
+                try:
+                    await self.llm.enrich_papers_batch(new_papers)
+                except Exception as e:
+                    self.logger.error(f"LLM enrichment failed: {e}")
+
+            # 保存新论文到数据库
+            if new_papers:
+                await self._run_db(self._save_papers, new_papers)
+
+        # 数据库读取失败时结果不完整，不缓存，下次重新检索
+        if complete:
+            self._store_search(query, max_results, papers)
         return papers
 
+    def _run_db(self, fn, *args):
+        """在数据库线程池中执行同步数据库调用"""
+        return asyncio.get_running_loop().run_in_executor(self.db_executor, fn, *args)
+
+    def _cached_search(self, query: str, max_results: int) -> Optional[List[PaperEntry]]:
+        """返回未过期的缓存结果，缓存的结果数不少于 max_results 时截取复用"""
+        entry = self._search_cache.get(query)
+        if entry is None:
+            return None
+        ts, cached_max, papers = entry
+        if time.monotonic() - ts >= self.search_cache_ttl or cached_max < max_results:
+            return None
+        return papers[:max_results]
+
+    def _store_search(self, query: str, max_results: int, papers: List[PaperEntry]):
+        now = time.monotonic()
+        # 顺带清理过期条目，避免缓存无限增长
+        expired = [q for q, (ts, _, _) in self._search_cache.items()
+                   if now - ts >= self.search_cache_ttl]
+        for q in expired:
+            del self._search_cache[q]
+        self._search_cache[query] = (now, max_results, papers)
+
+    async def aclose(self):
+        """关闭网络线程池和 LLM 连接"""
+        self._net_pool.shutdown(wait=False, cancel_futures=True)
+        if self.llm:
+            await self.llm.aclose()
+
     async def fetch_recent(self, category: str, max_results: int = None) -> List[PaperEntry]:
         """按分类抓取最新论文"""
         max_results = max_results or self.max_results
@@ -99,33 +137,37 @@ class ArxivClient:
         """抓取当天的新论文"""
         if categories is None:
             categories = getattr(self, 'default_categories', [])
+        if not categories:
+            return []
 
-        today = datetime.utcnow().date()
-        today_papers = []
+        # 日期过滤交给 arXiv 服务端，只返回当天提交的论文；各分类并发抓取
+        today = datetime.now(timezone.utc).strftime("%Y%m%d")
 
-        for cat in categories:
+        async def fetch(cat: str) -> List[PaperEntry]:
             self.logger.info(f"Fetching new papers in {cat}")
+            query = f"cat:{cat} AND submittedDate:[{today}0000 TO {today}2359]"
             try:
-                papers = await self.fetch_recent(cat)
+                return await self.search(query, self.max_results)
             except Exception as e:
                 self.logger.error(f"Failed to fetch recent papers for {cat}: {e}")
-                papers = []
+                return []
 
-            for p in papers:
-                if not p or not getattr(p, 'published', None):
-                    continue
-                try:
-                    pub_date = datetime.strptime(p.published, "%Y-%m-%dT%H:%M:%SZ").date()
-                    if pub_date == today:
-                        today_papers.append(p)
-                except Exception as e:
-                    self.logger.warning(f"Failed to parse published date '{p.published}': {e}")
-
-        return today_papers
+        results = await asyncio.gather(*(fetch(cat) for cat in categories))
+        return [p for papers in results for p in papers]
 
     # ---------------------------
     # 解析函数
     # ---------------------------
+    def _fetch_papers(self, search: arxiv.Search) -> List[PaperEntry]:
+        """同步拉取检索结果并转换为 PaperEntry（在线程中调用）"""
+        papers = []
+        for e in self.client.results(search):
+            try:
+                papers.append(self._entry_to_paper(e))
+            except Exception as ex:
+                self.logger.warning(f"Failed to convert arXiv entry to PaperEntry: {ex}")
+        return papers
+
     def _entry_to_paper(self, entry: arxiv.Result) -> PaperEntry:
         arxiv_id = entry.entry_id.split("/")[-1]
         authors = [a.name for a in entry.authors]
@@ -152,30 +194,79 @@ class ArxivClient:
     # ---------------------------
     # 数据库存储
     # ---------------------------
-    def _save_to_db(self, paper: PaperEntry):
+    def _split_known_papers(self, results: List[PaperEntry]):
+        """分流数据库已有和新论文，已有论文从数据库补全 AI 字段（在线程中调用）
+
+        返回 (papers, new_papers, complete)，数据库读取失败时 complete 为 False，只返回缓存中已知的论文。
+        """
+        known = {}
+        missing = []
+        for paper in results:
+            fields = self._paper_cache.get(paper.arxiv_id)
+            if fields is None:
+                missing.append(paper.arxiv_id)
+            else:
+                known[paper.arxiv_id] = fields
+
+        # 缓存未命中的论文一次性从数据库读取 tags, description, translation
+        try:
+            db_papers = self.db.get_papers_data(missing) if missing else {}
+        except Exception as ex:
+            self.logger.warning(f"Failed to load {len(missing)} papers from database: {ex}")
+            return [p for p in results if p.arxiv_id in known], [], False
+        for arxiv_id, db_paper in db_papers.items():
+            fields = (db_paper["tags"], db_paper["description"], db_paper["translation"])
+            known[arxiv_id] = fields
+            self._cache_paper(arxiv_id, fields)
+
+        papers = []
+        new_papers = []
+        for paper in results:
+            fields = known.get(paper.arxiv_id)
+            if fields is None:
+                new_papers.append(paper)
+            else:
+                paper.tags, paper.description, paper.translation = fields
+            papers.append(paper)  # 无论新旧，都加入返回列表
+        return papers, new_papers, True
+
+    def _cache_paper(self, arxiv_id: str, fields: tuple):
+        self._paper_cache[arxiv_id] = fields
+        if len(self._paper_cache) > self.paper_cache_size:
+            self._paper_cache.popitem(last=False)
+
+    def _save_papers(self, papers: List[PaperEntry]):
+        """批量写入新论文（在线程中调用），已存在的论文由数据库忽略"""
         if not self.db:
             self.logger.warning("No database configured; skipping saving papers.")
             return
 
+        rows = [self._paper_to_dict(p) for p in papers]
         try:
-            if self.db.paper_exists(paper.arxiv_id):
-                return
-            paper_dict = {
-                "arxiv_id": paper.arxiv_id,
-                "title": paper.title,
-                "authors": paper.authors,
-                "summary": paper.summary,
-                "published": paper.published,
-                "updated": paper.updated,
-                "category": paper.categories,
-                "link": paper.link,
-                "pdf_link": paper.pdf_link,
-                "comment": paper.comment or "",
-                "tags": paper.tags or [],
-                "description": paper.description or "",
-                "translation": paper.translation or ""
-            }
-            if self.db.insert_paper(paper_dict):
-                self.logger.info(f"Inserted new papers into database: {paper.arxiv_id}")
+            inserted = self.db.insert_papers_bulk(rows)
         except Exception as e:
-            self.logger.error(f"DB error while inserting paper {paper.arxiv_id}: {e}")
+            self.logger.error(f"DB error while inserting {len(rows)} papers: {e}")
+            return
+        for row in rows:
+            self._cache_paper(row["arxiv_id"], (row["tags"], row["description"],
+                                                row["translation"]))
+        if inserted:
+            self.logger.info(f"Inserted {inserted} new papers into database")
+
+    @staticmethod
+    def _paper_to_dict(paper: PaperEntry) -> dict:
+        return {
+            "arxiv_id": paper.arxiv_id,
+            "title": paper.title,
+            "authors": paper.authors,
+            "summary": paper.summary,
+            "published": paper.published,
+            "updated": paper.updated,
+            "category": paper.categories,
+            "link": paper.link,
+            "pdf_link": paper.pdf_link,
+            "comment": paper.comment or "",
+            "tags": paper.tags or [],
+            "description": paper.description or "",
+            "translation": paper.translation or ""
+        }
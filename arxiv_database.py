@@ -1,9 +1,16 @@
 from sqlalchemy import (create_engine, Column, Integer, String, Text, DateTime, UniqueConstraint,
                         JSON)
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, load_only
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from datetime import datetime, timezone
-from sqlalchemy import ForeignKey, Boolean
+import logging
+import time
+from sqlalchemy import (ForeignKey, Boolean, Index, column, exists, func, literal_column, select,
+                        text, values)
+from sqlalchemy.exc import SQLAlchemyError
+
+logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
@@ -11,6 +18,10 @@ Base = declarative_base()
 # =========================
 #  数据表定义
 # =========================
+# 标题+摘要的全文检索向量，search_papers 查询与 GIN 索引必须使用同一表达式
+_PAPER_TSV_SQL = "to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(summary, ''))"
+
+
 class Paper(Base):
     __tablename__ = "papers"
 
@@ -28,7 +39,10 @@ class Paper(Base):
     tags = Column(JSON)  # AI生成的标签，列表
     description = Column(Text)  # AI生成的简述
     translation = Column(Text, default="")  # AI生成的摘要翻译
-    __table_args__ = (UniqueConstraint("arxiv_id", name="_arxiv_id_uc"), )
+    __table_args__ = (
+        UniqueConstraint("arxiv_id", name="_arxiv_id_uc"),
+        Index("ix_papers_tsv", text(_PAPER_TSV_SQL), postgresql_using="gin"),
+    )
 
 
 class UserConfig(Base):
@@ -52,7 +66,11 @@ class PaperUserNotify(Base):
     user_id = Column(Integer, ForeignKey("user_config.user_id", ondelete="CASCADE"), nullable=False)
     sent_time = Column(DateTime, default=datetime.now(timezone.utc))
 
-    __table_args__ = (UniqueConstraint("arxiv_id", "user_id", name="_paper_user_uc"), )
+    __table_args__ = (
+        UniqueConstraint("arxiv_id", "user_id", name="_paper_user_uc"),
+        # 唯一约束以 arxiv_id 开头，按用户查询时使用该索引
+        Index("ix_notify_user_arxiv", "user_id", "arxiv_id"),
+    )
 
 
 # =========================
@@ -64,6 +82,9 @@ class DatabaseManager:
         self.config = db_config
         self.engine = None
         self.Session = None
+        # user_id -> (读取时间, UserConfig)，写入时失效
+        self._user_cache: dict[int, tuple[float, UserConfig | None]] = {}
+        self.user_cache_ttl = 30
         self._connect()
 
     def _connect(self):
@@ -74,25 +95,47 @@ class DatabaseManager:
         name = self.config.get("name", "arxiv_bot")
 
         db_url = f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{name}"
-        self.engine = create_engine(db_url, echo=False, future=True)
+        # 连接池复用长连接；pre_ping 检测失效连接，recycle 避免被服务端超时断开
+        # 每个进程一个连接池；各进程 pool_size + max_overflow 之和应小于 Postgres 的 max_connections
+        self.engine = create_engine(db_url,
+                                    echo=False,
+                                    future=True,
+                                    pool_size=self.config.get("pool_size", 10),
+                                    max_overflow=self.config.get("max_overflow", 20),
+                                    pool_pre_ping=True,
+                                    pool_recycle=1800)
         self.Session = sessionmaker(bind=self.engine)
+
+    def ensure_schema(self):
+        """创建缺失的表和索引，启动时调用一次"""
         Base.metadata.create_all(self.engine)
+        # create_all 不会给已存在的表补建索引，单独检查创建
+        for table in (Paper.__table__, PaperUserNotify.__table__):
+            for index in table.indexes:
+                index.create(self.engine, checkfirst=True)
 
     # =========================
     #  论文操作
     # =========================
 
     def insert_paper(self, paper_data: dict) -> bool:
+        """插入单篇论文，转发到批量插入；论文已存在时返回 False"""
+        try:
+            return self.insert_papers_bulk([paper_data]) > 0
+        except SQLAlchemyError as e:
+            logger.warning(f"Failed to insert paper {paper_data.get('arxiv_id')}: {e}")
+            return False
+
+    def insert_papers_bulk(self, papers: list[dict]) -> int:
+        """批量插入论文，单条语句写入，已存在的 arxiv_id 忽略，返回实际插入条数"""
+        if not papers:
+            return 0
         with self.Session() as session:
-            try:
-                new_paper = Paper(**paper_data)
-                session.add(new_paper)
-                session.commit()
-                return True
-            except Exception as e:
-                session.rollback()  # 回滚事务
-                print(f"Error inserting paper: {e}")
-                return False
+            stmt = pg_insert(Paper).values(papers).on_conflict_do_nothing(
+                index_elements=["arxiv_id"])
+            result = session.execute(stmt)
+            session.commit()
+            return result.rowcount
 
     def delete_paper(self, arxiv_id: str) -> bool:
         """根据 arxiv_id 删除论文"""
@@ -112,28 +155,40 @@ class DatabaseManager:
             paper = session.query(Paper).filter_by(arxiv_id=arxiv_id).first()
             if not paper:
                 return None
+            return self._paper_dict(paper)
 
-            return {
-                "arxiv_id": paper.arxiv_id,
-                "title": paper.title,
-                "authors": paper.authors or [],
-                "summary": paper.summary or "",
-                "published": paper.published or "",
-                "updated": paper.updated or "",
-                "category": paper.category or [],
-                "link": paper.link or "",
-                "pdf_link": paper.pdf_link or "",
-                "comment": paper.comment or "",
-                "tags": paper.tags or [],
-                "description": paper.description or "",
-                "translation": paper.translation or ""
-            }
+    def get_papers_data(self, arxiv_ids: list[str]) -> dict[str, dict]:
+        """一次查询返回多篇论文的数据，arxiv_id -> 数据字典，不存在的论文不在结果中"""
+        if not arxiv_ids:
+            return {}
+        with self.Session() as session:
+            papers = session.query(Paper).filter(Paper.arxiv_id.in_(arxiv_ids)).all()
+            return {p.arxiv_id: self._paper_dict(p) for p in papers}
+
+    @staticmethod
+    def _paper_dict(paper: Paper) -> dict:
+        return {
+            "arxiv_id": paper.arxiv_id,
+            "title": paper.title,
+            "authors": paper.authors or [],
+            "summary": paper.summary or "",
+            "published": paper.published or "",
+            "updated": paper.updated or "",
+            "category": paper.category or [],
+            "link": paper.link or "",
+            "pdf_link": paper.pdf_link or "",
+            "comment": paper.comment or "",
+            "tags": paper.tags or [],
+            "description": paper.description or "",
+            "translation": paper.translation or ""
+        }
 
     def search_papers(self, keyword: str):
+        """按词检索标题和摘要，走 ix_papers_tsv GIN 索引"""
         with self.Session() as session:
-            q = f"%{keyword}%"
-            return session.query(Paper).filter((Paper.title.like(q))
-                                               | (Paper.summary.like(q))).all()
+            query = func.plainto_tsquery(literal_column("'simple'"), keyword)
+            return session.query(Paper).filter(
+                literal_column(_PAPER_TSV_SQL).op("@@")(query)).all()
 
     def paper_exists(self, arxiv_id: str) -> bool:
         with self.Session() as session:
@@ -152,8 +207,33 @@ class DatabaseManager:
                 user = UserConfig(user_id=user_id, **config)
                 session.add(user)
             session.commit()
+        self._invalidate_user(user_id)
+
+    def append_search_query(self, user_id: int, query_obj: dict, platform: str = "telegram") -> bool:
+        """在单个事务中检查并追加检索式，检索式已存在时返回 False"""
+        with self.Session() as session:
+            # 行锁保证并发追加时检查与写入的原子性
+            user = session.query(UserConfig).filter_by(user_id=user_id).with_for_update().first()
+            if not user:
+                session.add(
+                    UserConfig(user_id=user_id, platform=platform, search_queries=[query_obj]))
+                session.commit()
+                self._invalidate_user(user_id)
+                return True
+            queries = user.search_queries or []
+            if query_obj.get("query") in {q.get("query") for q in queries}:
+                return False
+            user.search_queries = queries + [query_obj]
+            user.platform = platform
+            session.commit()
+            self._invalidate_user(user_id)
+            return True
 
     def get_user_config(self, user_id: int):
+        """读取用户配置，短时间内的重复读取直接返回缓存"""
+        cached = self._user_cache.get(user_id)
+        if cached and time.monotonic() - cached[0] < self.user_cache_ttl:
+            return cached[1]
         with self.Session() as session:
             user = session.query(UserConfig).filter_by(user_id=user_id).first()
             if user and user.search_queries:
@@ -162,12 +242,16 @@ class DatabaseManager:
                     sq.get('query', '') for sq in user.search_queries if sq.get('query')
                 ]
                 user.keywords = ' '.join(keywords_list)
-            return user
+        self._user_cache[user_id] = (time.monotonic(), user)
+        return user
+
+    def _invalidate_user(self, user_id: int):
+        self._user_cache.pop(user_id, None)
 
     def get_all_users(self):
         """返回数据库中所有用户配置，用于后台循环推送"""
         with self.Session() as session:
-            users = session.query(UserConfig).all()
+            users = session.query(UserConfig).options(self._user_list_columns()).all()
             # 为向后兼容，为每个用户添加 keywords 属性
             for user in users:
                 if user.search_queries:
@@ -179,10 +263,17 @@ class DatabaseManager:
                     user.keywords = None
             return users
 
+    @staticmethod
+    def _user_list_columns():
+        """批量读取用户时只加载推送需要的列，不读取 description 等大字段"""
+        return load_only(UserConfig.user_id, UserConfig.platform, UserConfig.search_queries,
+                         UserConfig.since_days, UserConfig.last_check)
+
     def get_users_by_platform(self, platform: str):
         """获取指定平台的所有用户配置"""
         with self.Session() as session:
-            users = session.query(UserConfig).filter(UserConfig.platform == platform).all()
+            users = session.query(UserConfig).options(self._user_list_columns()).filter(
+                UserConfig.platform == platform).all()
             for user in users:
                 if user.search_queries:
                     keywords_list = [
@@ -202,6 +293,7 @@ class DatabaseManager:
         return self.get_users_by_platform("matrix")
 
     def delete_user(self, user_id: int) -> bool:
+        self._invalidate_user(user_id)
         with self.Session() as session:
             user = session.query(UserConfig).filter_by(user_id=user_id).first()
             if not user:
@@ -218,14 +310,48 @@ class DatabaseManager:
             return exists is not None
 
     def sended(self, arxiv_id: str, user_id: int):
-        """记录该论文已发送给用户"""
+        """记录该论文已发送给用户，已存在时返回 False"""
+        return self.sended_many([(arxiv_id, user_id)]) > 0
+
+    def get_sended_ids(self, user_id: int, arxiv_ids: list[str]) -> set[str]:
+        """批量查询 arxiv_ids 中已发送给该用户的论文ID集合"""
+        if not arxiv_ids:
+            return set()
+        with self.Session() as session:
+            records = session.query(PaperUserNotify.arxiv_id).filter(
+                PaperUserNotify.user_id == user_id,
+                PaperUserNotify.arxiv_id.in_(arxiv_ids)).all()
+            return {r.arxiv_id for r in records}
+
+    def get_sended_map(self, arxiv_ids: list[str]) -> dict[str, set[int]]:
+        """批量查询每篇论文已发送的用户集合，返回 arxiv_id -> {user_id}"""
+        if not arxiv_ids:
+            return {}
         with self.Session() as session:
-            if self.is_sended(arxiv_id, user_id):
-                return False  # 已存在
-            record = PaperUserNotify(arxiv_id=arxiv_id, user_id=user_id)
-            session.add(record)
+            records = session.query(PaperUserNotify.arxiv_id, PaperUserNotify.user_id).filter(
+                PaperUserNotify.arxiv_id.in_(arxiv_ids)).all()
+            sended: dict[str, set[int]] = {}
+            for r in records:
+                sended.setdefault(r.arxiv_id, set()).add(r.user_id)
+            return sended
+
+    def sended_many(self, records: list[tuple[str, int]]) -> int:
+        """批量记录 (arxiv_id, user_id) 已发送，单个事务写入，已存在或论文/用户不存在的记录跳过"""
+        if not records:
+            return 0
+        rows = values(column("arxiv_id", String(64)), column("user_id", Integer),
+                      name="new_notify").data(list(set(records)))
+        # 只写入论文和用户都存在的记录，个别论文未入库时不影响同批其他记录
+        select_rows = select(rows.c.arxiv_id, rows.c.user_id).where(
+            exists().where(Paper.arxiv_id == rows.c.arxiv_id),
+            exists().where(UserConfig.user_id == rows.c.user_id))
+        with self.Session() as session:
+            stmt = pg_insert(PaperUserNotify).from_select(
+                ["arxiv_id", "user_id"], select_rows).on_conflict_do_nothing(
+                    index_elements=["arxiv_id", "user_id"])
+            result = session.execute(stmt)
             session.commit()
-            return True
+            return result.rowcount
 
     def get_sended_users(self, arxiv_id: str) -> list[int]:
         """获取已经收到该论文的用户ID列表"""
@@ -1,8 +1,12 @@
 import asyncio
+import json
 import httpx
 import re
 from typing import List
 
+# 标签分隔符：逗号、分号、换行
+_TAG_SPLIT_RE = re.compile(r"[,;\n]+")
+
 
 class BaseLLMClient:
     """通用大语言模型客户端接口（HTTP / 本地 LLM）"""
@@ -18,6 +22,20 @@ class BaseLLMClient:
         self.model = model
         self.timeout = timeout
         self.max_retries = max_retries
+        self._client: httpx.AsyncClient | None = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """复用同一个 AsyncClient，保持连接池与 keep-alive，避免每次请求重新握手"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_keepalive_connections=20, max_connections=50))
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
     async def generate(self, messages: list) -> str:
         """异步调用 LLM 生成文本，带重试"""
@@ -29,11 +47,12 @@ class BaseLLMClient:
 
         for attempt in range(self.max_retries):
             try:
-                async with httpx.AsyncClient(timeout=self.timeout) as client:
-                    response = await client.post(self.endpoint, json=payload, headers=headers)
-                    response.raise_for_status()
-                    data = response.json()
-                    return data['choices'][0]['message']['content'].strip()
+                response = await self._get_client().post(self.endpoint,
+                                                         json=payload,
+                                                         headers=headers)
+                response.raise_for_status()
+                data = response.json()
+                return data['choices'][0]['message']['content'].strip()
             except (httpx.RequestError, httpx.HTTPStatusError) as e:
                 if attempt < self.max_retries - 1:
                     await asyncio.sleep(2**attempt)
@@ -44,20 +63,53 @@ class BaseLLMClient:
 class PaperAI:
     """为论文提供 AI tag、中文总结和摘要翻译模块"""
 
+    # 提示词中固定的部分，所有论文共享
+    _SYS_ANALYST = {"role": "system", "content": "你是一个学术论文分析助手。"}
+    _SYS_TRANSLATOR = {"role": "system", "content": "你是一个学术论文翻译助手。"}
+    _TAG_TEMPLATE = "请根据以下论文标题和摘要生成不超过{max_tags}个标签，简短且用中文，以逗号分隔输出。\n标题：{title}\n摘要：{abstract}"
+    _SUMMARY_TEMPLATE = "请将以下论文标题和摘要总结为中文，不超过三句话，保持学术风格，纯文本，仅输出总结内容。\n标题：{title}\n摘要：{abstract}"
+    _TRANSLATION_TEMPLATE = "请将以下英文摘要翻译成中文，保持学术风格，纯文本输出，仅翻译内容，不要增加评论。\n摘要：{abstract}"
+    _COMBINED_TEMPLATE = (
+        "请根据以下论文标题和摘要，仅输出一个 JSON 对象，不要输出其他内容，格式为："
+        "{{\"tags\": [不超过{max_tags}个简短的中文标签], "
+        "\"summary\": \"不超过三句话的中文总结，保持学术风格\", "
+        "\"translation\": \"摘要的完整中文翻译，保持学术风格，不要增加评论\"}}"
+        "\n标题：{title}\n摘要：{abstract}")
+
     def __init__(self,
                  llm_client: BaseLLMClient,
                  max_tags_prompt: int = 5,
-                 max_concurrency: int = 5):
+                 max_concurrency: int = 5,
+                 max_abstract_chars: int = 1500):
         self.llm_client = llm_client
         self.max_tags_prompt = max_tags_prompt
+        # 生成标签和总结时截断过长的摘要，节省 token；翻译始终使用完整摘要
+        self.max_abstract_chars = max_abstract_chars
         self.semaphore = asyncio.Semaphore(max_concurrency)
 
+    async def aclose(self):
+        """关闭底层 LLM 客户端的连接池"""
+        await self.llm_client.aclose()
+
     # -----------------
     # 单篇论文处理
     # -----------------
     async def enrich_paper(self, paper) -> None:
         """为单篇论文生成 tags、中文 summary 和摘要翻译"""
         async with self.semaphore:
+            try:
+                # 优先用一次请求同时生成三项，标题和摘要只上传一次
+                paper.tags, paper.description, paper.translation = await self.enrich_all_in_one(
+                    paper.title, paper.summary)
+                return
+            except (ValueError, KeyError, TypeError):
+                pass  # 模型未按 JSON 格式输出，退回分别生成
+            except Exception:
+                paper.tags = []
+                paper.description = ""
+                paper.translation = ""
+                return
+
             tag_task = asyncio.create_task(self.generate_tags(paper.title, paper.summary))
             summary_task = asyncio.create_task(self.summarize_cn(paper.title, paper.summary))
             translate_task = asyncio.create_task(self.translate_abstract(paper.summary))
@@ -70,45 +122,81 @@ class PaperAI:
                 paper.description = ""
                 paper.translation = ""
 
+    # -----------------
+    # 合并生成功能
+    # -----------------
+    async def enrich_all_in_one(self, title: str, abstract: str) -> tuple[List[str], str, str]:
+        """一次 LLM 调用返回 (tags, summary, translation)，输出不是合法 JSON 时抛出 ValueError"""
+        messages = self._build_combined_messages(title, abstract)
+        return self._parse_combined(await self.llm_client.generate(messages))
+
+    def _build_combined_messages(self, title: str, abstract: str) -> list:
+        return [
+            self._SYS_ANALYST, {
+                "role":
+                "user",
+                "content":
+                self._COMBINED_TEMPLATE.format(max_tags=self.max_tags_prompt,
+                                               title=title,
+                                               abstract=abstract)
+            }
+        ]
+
+    def _parse_combined(self, output: str) -> tuple[List[str], str, str]:
+        # 兼容模型用 ```json 代码块包裹输出
+        start, end = output.find("{"), output.rfind("}")
+        if start < 0 or end < start:
+            raise ValueError("no JSON object in LLM output")
+        data = json.loads(output[start:end + 1])
+        tags = data["tags"]
+        if isinstance(tags, str):
+            tags = self._parse_tags(tags)
+        tags = [str(t).strip() for t in tags if str(t).strip()][:self.max_tags_prompt]
+        summary, translation = data["summary"], data["translation"]
+        if not isinstance(summary, str) or not isinstance(translation, str):
+            raise TypeError("summary and translation must be strings")
+        return tags, summary.strip(), translation.strip()
+
     # -----------------
     # 自动 tag 功能
     # -----------------
     async def generate_tags(self, title: str, abstract: str) -> List[str]:
-        messages = self._build_tag_messages(title, abstract)
+        messages = self._build_tag_messages(title, abstract[:self.max_abstract_chars])
         raw_output = await self.llm_client.generate(messages)
         return self._parse_tags(raw_output)
 
     def _build_tag_messages(self, title: str, abstract: str) -> list:
-        return [{
-            "role": "system",
-            "content": "你是一个学术论文分析助手。"
-        }, {
-            "role":
-            "user",
-            "content":
-            f"请根据以下论文标题和摘要生成不超过{self.max_tags_prompt}个标签，简短且用中文，以逗号分隔输出。\n标题：{title}\n摘要：{abstract}"
-        }]
+        return [
+            self._SYS_ANALYST, {
+                "role":
+                "user",
+                "content":
+                self._TAG_TEMPLATE.format(max_tags=self.max_tags_prompt,
+                                          title=title,
+                                          abstract=abstract)
+            }
+        ]
 
     def _parse_tags(self, output: str) -> List[str]:
-        tags = re.split(r"[,;\n]+", output)
+        # 只需要前 max_tags_prompt 个标签，限制切分次数
+        tags = _TAG_SPLIT_RE.split(output, maxsplit=self.max_tags_prompt * 2)
         return [t.strip() for t in tags if t.strip()][:self.max_tags_prompt]
 
     # -----------------
     # 中文总结功能
     # -----------------
     async def summarize_cn(self, title: str, abstract: str) -> str:
-        messages = self._build_summary_messages(title, abstract)
+        messages = self._build_summary_messages(title, abstract[:self.max_abstract_chars])
         return (await self.llm_client.generate(messages)).strip()
 
     def _build_summary_messages(self, title: str, abstract: str) -> list:
         # 修改提示词：总结不超过三句话
-        return [{
-            "role": "system",
-            "content": "你是一个学术论文分析助手。"
-        }, {
-            "role": "user",
-            "content": f"请将以下论文标题和摘要总结为中文，不超过三句话，保持学术风格，纯文本，仅输出总结内容。\n标题：{title}\n摘要：{abstract}"
-        }]
+        return [
+            self._SYS_ANALYST, {
+                "role": "user",
+                "content": self._SUMMARY_TEMPLATE.format(title=title, abstract=abstract)
+            }
+        ]
 
     # -----------------
     # 摘要翻译功能
@@ -118,13 +206,12 @@ class PaperAI:
         return (await self.llm_client.generate(messages)).strip()
 
     def _build_translation_messages(self, abstract: str) -> list:
-        return [{
-            "role": "system",
-            "content": "你是一个学术论文翻译助手。"
-        }, {
-            "role": "user",
-            "content": f"请将以下英文摘要翻译成中文，保持学术风格，纯文本输出，仅翻译内容，不要增加评论。\n摘要：{abstract}"
-        }]
+        return [
+            self._SYS_TRANSLATOR, {
+                "role": "user",
+                "content": self._TRANSLATION_TEMPLATE.format(abstract=abstract)
+            }
+        ]
 
     # -----------------
     # 批量处理功能
@@ -1,25 +1,30 @@
 # main.py
-from time import sleep
 import yaml
 import os
 import logging
 import asyncio
+import gc
+import signal
 import multiprocessing
 from arxiv_database import DatabaseManager
-from arxiv_client import ArxivClient
-from arxiv_tgbot import TgBot
-from arxiv_llm import BaseLLMClient, PaperAI
-from arxiv_matrix_bot import MatrixBot
+# ArxivClient、LLM 与各 Bot 模块在子进程入口内按需导入，主进程不加载用不到的依赖
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# 优先使用 libyaml 的 C 实现解析配置，未安装时退回纯 Python 实现
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+logger.info(f"YAML loader: {_YamlLoader.__name__}")
+
 
 def load_config(config_file: str = "config.yaml") -> dict:
     if not os.path.exists(config_file):
         raise FileNotFoundError(f"Config file not found: {config_file}")
     with open(config_file, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+        return yaml.load(f, Loader=_YamlLoader)
 
 
 def setup_network_proxy(config: dict):
@@ -37,6 +42,9 @@ def setup_network_proxy(config: dict):
 
 def init_arxiv_client(config: dict):
     """每个进程单独初始化 ArxivClient"""
+    from arxiv_client import ArxivClient
+    from arxiv_llm import BaseLLMClient, PaperAI
+
     llm_client = BaseLLMClient(**config["llm"])
     arxiv_llm = PaperAI(llm_client, **config["llm_generation"])
     arxiv_client = ArxivClient(config, db=None, llm=arxiv_llm)
@@ -45,6 +53,8 @@ def init_arxiv_client(config: dict):
 
 def run_telegram_bot(config):
     """Telegram Bot 进程"""
+    from arxiv_tgbot import TgBot
+
     db = DatabaseManager(config["database"])  # PostgreSQL 单独连接
     arxiv_client = init_arxiv_client(config)
     arxiv_client.db = db
@@ -56,25 +66,29 @@ def run_telegram_bot(config):
 
 def run_matrix_bot(config):
     """Matrix Bot 进程"""
-    sleep(2)  # 避免与 Telegram 进程同时初始化数据库连接引起冲突
+    from arxiv_matrix_bot import MatrixBot
+
     db = DatabaseManager(config["database"])  # PostgreSQL 单独连接
     arxiv_client = init_arxiv_client(config)
     arxiv_client.db = db
 
-    matrix_bot = MatrixBot(config, db, arxiv_client)  # 初始化时已启动后台抓取
-    logger.info("Matrix bot initialized. Background fetch loop started.")
-    try:
-        # 主进程保持存活
-        asyncio.run(_matrix_main_loop())
-    except KeyboardInterrupt:
-        logger.info("Matrix bot stopping...")
-        asyncio.run(matrix_bot.stop())
+    matrix_bot = MatrixBot(config, db, arxiv_client)
+    logger.info("Matrix bot initialized. Starting background fetch loop...")
+    asyncio.run(_matrix_main_loop(matrix_bot))
+
 
+async def _matrix_main_loop(matrix_bot):
+    """启动 MatrixBot 后台抓取，阻塞等待 SIGTERM/SIGINT 后优雅退出"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
 
-async def _matrix_main_loop():
-    """让主进程保持存活，实际抓取在 MatrixBot 内部异步循环"""
-    while True:
-        await asyncio.sleep(3600)
+    await matrix_bot.start_loop()
+    await stop.wait()
+    logger.info("Matrix bot stopping...")
+    await matrix_bot.stop()
+    await matrix_bot.arxiv_client.aclose()
 
 
 def main():
@@ -83,9 +97,17 @@ def main():
 
     setup_network_proxy(config)
 
+    # 在启动 bot 进程前建表一次，避免各进程同时执行 DDL
+    db = DatabaseManager(config["database"])
+    db.ensure_schema()
+    db.engine.dispose()  # 子进程各自建立连接，不继承父进程的连接
+
     telegram_process = multiprocessing.Process(target=run_telegram_bot, args=(config, ))
     # matrix_process = multiprocessing.Process(target=run_matrix_bot, args=(config, ))
 
+    # fork 前冻结已有对象，子进程的垃圾回收不再遍历它们，减少写时复制导致的内存页复制
+    gc.collect()
+    gc.freeze()
     telegram_process.start()
     # matrix_process.start()
 
@@ -3,19 +3,33 @@ import logging
 from datetime import datetime
 from typing import List
 import requests
+from requests.adapters import HTTPAdapter
 import markdown
 import hashlib
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# 优先使用 orjson 序列化请求体，未安装时退回标准库 json
+try:
+    import orjson
+
+    def _json_dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+except ImportError:
+    import json
+
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
 
 def room_id_to_int(room_id: str, digits: int = 9) -> int:
     """
     将任意字符串 room_id 映射为指定长度的整数，用于数据库 integer 字段
     """
-    h = hashlib.sha256(room_id.encode("utf-8")).hexdigest()
-    num = int(h[:12], 16)
+    # 取摘要前 6 字节，与原先截取前 12 位十六进制再解析的结果一致；
+    # 该值已作为数据库中的用户 ID，不能更换哈希算法
+    num = int.from_bytes(hashlib.sha256(room_id.encode("utf-8")).digest()[:6], "big")
     return num % (10**digits)
 
 
@@ -38,6 +52,12 @@ class MatrixBot:
         self.room_id = matrix_cfg["room_id"]
         self.room_id_db = room_id_to_int(self.room_id)  # 数据库用整数 ID
         self.arxiv_queries = matrix_cfg.get("arxiv_queries", [])
+        # 复用 HTTP 连接，避免每次请求重新建立 TCP/TLS 连接
+        self._session = requests.Session()
+        self._session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+        self._session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+        # 复用同一个 Markdown 实例，避免每条消息重新注册扩展、编译正则
+        self._md = markdown.Markdown()
 
         # 将 room_id_db 当作“用户”加入或更新用户表
         try:
@@ -57,6 +77,10 @@ class MatrixBot:
         self._running = True
         # 注意: 初始化时不要直接 create_task，需在已有事件循环中启动
         self._background_task = None
+        # 待发送消息队列，由单独的发送任务消费，抓取与网络发送互不阻塞
+        self._out_queue: asyncio.Queue | None = None
+        self._sender_task = None
+        self._pending_records: list[tuple[str, int]] = []
 
     # ---------------- Matrix API ----------------
 
@@ -66,13 +90,17 @@ class MatrixBot:
         if self.access_token:
             params = params or {}
             params["access_token"] = self.access_token
+        body = None
+        if json_data is not None:
+            body = _json_dumps(json_data)
+            headers["Content-Type"] = "application/json"
 
-        resp = requests.request(method, url, params=params, json=json_data, headers=headers)
+        resp = self._session.request(method, url, params=params, data=body, headers=headers)
         resp.raise_for_status()
         return resp.json()
 
-    def send_message(self, message: str, formatted_message: str):
-        """发送消息到房间（Matrix API 使用原始 room_id）"""
+    def send_message(self, message: str, formatted_message: str) -> bool:
+        """发送消息到房间（Matrix API 使用原始 room_id），返回是否发送成功"""
         path = f"/_matrix/client/r0/rooms/{self.room_id}/send/m.room.message"
         data = {
             "msgtype": "m.text",
@@ -83,61 +111,108 @@ class MatrixBot:
         try:
             self._send_request("POST", path, json_data=data)
             logger.info(f"Message sent to room {self.room_id}")
+            return True
         except Exception as e:
             logger.error(f"Failed to send message: {e}")
+            return False
 
     # ---------------- Paper Message ----------------
 
-    async def build_message(self, paper):
+    def build_message(self, paper):
         """构造消息文本"""
-        ar5iv_link = f"https://ar5iv.labs.arxiv.org/html/{paper.arxiv_id}"
-        msg_lines = [
-            f"**{paper.title}**",
-            f"Authors: {', '.join(paper.authors)}",
-            f"Published: **{paper.published}**",
-        ]
-        if getattr(paper, "tags", None):
-            msg_lines.append(f"Tags: {', '.join(paper.tags)}")
-        if getattr(paper, "description", None):
-            msg_lines.append(f"Summary: **{paper.description}**")
-        if getattr(paper, "translation", None):
-            msg_lines.append(f"Translation: {paper.translation}")
-        msg_lines.append(f"Comment: {paper.comment}")
-        msg_lines.append(f"Categories: {', '.join(paper.categories)}")
-        msg_lines.append(
-            f"Continue: [Links]({paper.link}) | [PDF]({paper.pdf_link}) | [Ar5iv]({ar5iv_link})")
-
-        plain_text = "\n".join(msg_lines)
-        html_message = markdown.markdown(plain_text)
+        tags = f"Tags: {', '.join(paper.tags)}\n" if getattr(paper, "tags", None) else ""
+        summary = (f"Summary: **{paper.description}**\n"
+                   if getattr(paper, "description", None) else "")
+        translation = (f"Translation: {paper.translation}\n"
+                       if getattr(paper, "translation", None) else "")
+        plain_text = (
+            f"**{paper.title}**\n"
+            f"Authors: {', '.join(paper.authors)}\n"
+            f"Published: **{paper.published}**\n"
+            f"{tags}{summary}{translation}"
+            f"Comment: {paper.comment}\n"
+            f"Categories: {', '.join(paper.categories)}\n"
+            f"Continue: [Links]({paper.link}) | [PDF]({paper.pdf_link}) | "
+            f"[Ar5iv](https://ar5iv.labs.arxiv.org/html/{paper.arxiv_id})")
+        html_message = self._md.reset().convert(plain_text)
         return plain_text, html_message
 
     # ---------------- Fetch & Push ----------------
 
     async def fetch_and_send(self):
-        """抓取所有检索式并发送到 Matrix"""
-        for query_cfg in self.arxiv_queries:
-            query_text = query_cfg["query"]
-            max_results = query_cfg.get("max_results", 5)
+        """并发抓取所有检索式并发送到 Matrix，arxiv 请求并发数由 ArxivClient 内部限制"""
+        self._ensure_sender()
+        # 本轮已认领发送的论文，避免多个检索式命中同一篇时重复推送
+        claimed = set()
+        await asyncio.gather(*(self._process_query(q, claimed) for q in self.arxiv_queries))
+        # 等待本轮消息发送完毕，下一轮的去重查询才能看到发送记录
+        await self._out_queue.join()
+
+    async def _process_query(self, query_cfg, claimed: set):
+        """抓取单个检索式并发送未推送过的论文"""
+        query_text = query_cfg["query"]
+        max_results = query_cfg.get("max_results", 5)
+
+        try:
+            papers = await self.arxiv_client.search(query_text, max_results)
+        except Exception as e:
+            logger.error(f"Failed to fetch papers for query {query_text}: {e}")
+            return
+        if not papers:
+            return
+
+        # 一次查询本检索式结果中已发送过的论文
+        try:
+            already_sended = await asyncio.to_thread(self.db.get_sended_ids, self.room_id_db,
+                                                     [p.arxiv_id for p in papers])
+        except Exception as e:
+            logger.error(f"Failed to load sent papers for query {query_text}: {e}")
+            return
 
+        for paper in papers:
+            if paper.arxiv_id in already_sended or paper.arxiv_id in claimed:
+                continue
+            claimed.add(paper.arxiv_id)
             try:
-                papers = await asyncio.to_thread(self.arxiv_client.search, query_text, max_results)
+                plain_msg, formatted_msg = self.build_message(paper)
             except Exception as e:
-                logger.error(f"Failed to fetch papers for query {query_text}: {e}")
+                logger.error(f"Failed to build message for paper {paper.arxiv_id}: {e}")
                 continue
+            # 队列满时在此等待，形成背压
+            await self._out_queue.put((plain_msg, formatted_msg, paper.arxiv_id))
 
-            for paper in papers:
-                try:
-                    already_sended = await asyncio.to_thread(self.db.is_sended, paper.arxiv_id,
-                                                             self.room_id_db)
-                    if already_sended:
-                        continue
+    # ---------------- Sender ----------------
 
-                    plain_msg, formatted_msg = await self.build_message(paper)
-                    self.send_message(plain_msg, formatted_msg)
+    def _ensure_sender(self):
+        """在当前事件循环中创建发送队列与发送任务"""
+        if self._sender_task is None:
+            self._out_queue = asyncio.Queue(maxsize=32)
+            self._sender_task = asyncio.create_task(self._sender())
 
-                    await asyncio.to_thread(self.db.sended, paper.arxiv_id, self.room_id_db)
-                except Exception as e:
-                    logger.error(f"Failed to send paper {paper.arxiv_id}: {e}")
+    async def _sender(self):
+        """逐条发送队列中的消息，发送成功的论文在队列清空时批量记录"""
+        while True:
+            plain_msg, formatted_msg, arxiv_id = await self._out_queue.get()
+            try:
+                if await asyncio.to_thread(self.send_message, plain_msg, formatted_msg):
+                    self._pending_records.append((arxiv_id, self.room_id_db))
+            except Exception as e:
+                logger.error(f"Failed to send paper {arxiv_id}: {e}")
+            finally:
+                # 先写入发送记录再标记完成，join() 返回时记录已落库
+                if self._out_queue.empty():
+                    await self._flush_records()
+                self._out_queue.task_done()
+
+    async def _flush_records(self):
+        """将发送成功的论文一次写入数据库"""
+        if not self._pending_records:
+            return
+        records, self._pending_records = self._pending_records, []
+        try:
+            await asyncio.to_thread(self.db.sended_many, records)
+        except Exception as e:
+            logger.error(f"Failed to record {len(records)} sent papers: {e}")
 
     # ---------------- Background Loop ----------------
 
@@ -169,4 +244,12 @@ class MatrixBot:
                 await self._background_task
             except asyncio.CancelledError:
                 logger.info("Background task cancelled")
+        if self._sender_task:
+            self._sender_task.cancel()
+            try:
+                await self._sender_task
+            except asyncio.CancelledError:
+                pass
+            await self._flush_records()
+        self._session.close()
         logger.info("MatrixBot stopped successfully")
@@ -1,12 +1,16 @@
 # arxiv_bot.py
 import asyncio
+import functools
 import logging
 import asyncio
 import re
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, List
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, AIORateLimiter, CallbackQueryHandler, MessageHandler, filters
 
 logger = logging.getLogger(__name__)
@@ -15,14 +19,50 @@ logging.basicConfig(level=logging.INFO)
 # 定义对话状态
 SETTING_KEYWORDS, ADDING_KEYWORD, ADDING_MAX_RESULTS, DELETING_KEYWORD = range(4)
 
-from telegram.helpers import escape_markdown
+# MarkdownV2 需要转义的字符，与 telegram.helpers.escape_markdown(version=2) 一致
+_MD2_TABLE = str.maketrans({c: "\\" + c for c in r"\_*[]()~`>#+-=|{}.!"})
+
+
+# 只缓存短文本（作者、分类、检索式等会反复出现的字段），长的标题、摘要不占用缓存
+_M2_CACHE_MAX_LEN = 64
+
+
+@functools.lru_cache(maxsize=1024)
+def _m2_short(text: str) -> str:
+    return text.translate(_MD2_TABLE)
 
 
 def m2(text: str) -> str:
     """安全地转义 MarkdownV2 文本"""
     if text is None:
         return ""
-    return escape_markdown(str(text), version=2)
+    text = str(text)
+    if len(text) <= _M2_CACHE_MAX_LEN:
+        return _m2_short(text)
+    return text.translate(_MD2_TABLE)
+
+
+def format_queries(queries: list, markdown: bool = False) -> str:
+    """将检索式列表格式化为编号文本，markdown=True 时输出 MarkdownV2"""
+    if markdown:
+        return "".join(
+            m2(f"{i}. ") + f"`{q['query']}`" + m2(f" (最大结果: {q['max_results']})") + "\n"
+            for i, q in enumerate(queries, 1))
+    return "".join(f"{i}. {q['query']} (最大结果: {q['max_results']})\n"
+                   for i, q in enumerate(queries, 1))
+
+
+# 已转义的列表项前缀
+DASH = m2("-")
+
+# /start 欢迎消息，导入时转义一次
+_START_MESSAGE = f"您好！我是您的 Arxiv 机器人。\n\n本机器人会定期为您推送最新的 **Arxiv** 论文。\n您只需要设定检索式，便可以开始接收推送。当前管理员设定的抓取间隔为 6 小时。\n\n我将通过API获取检索论文并使用AI为您生成标签和摘要。 \n\n*请注意，检索式请尽量使用all字段进行组合查询，title字段可能获取不到预期的结果。*\n\n我将按照发布时间降序推送。但都是最新的论文。请不用担心时间顺序。\n以下是检索式例子：\n\n`{m2("cat:cs.CV AND (all:\"object detection\")")}`\n"
+
+# Telegram 单条消息上限 4096 字符，预留余量
+MESSAGE_LIMIT = 4000
+MESSAGE_SEPARATOR = f"\n\n{m2('---')}\n\n"
+# 已渲染论文消息的缓存条数上限
+MESSAGE_CACHE_SIZE = 1024
 
 
 class TgBot:
@@ -34,13 +74,32 @@ class TgBot:
         self.arxiv_client = arxiv_client
         self.token = config["telegram"]["token"]
         self.fetch_interval_hours = config["arxiv"].get("fetch_interval_hours", 6)
+        # 数据库调用使用独立线程池，大小不超过数据库连接池容量
+        self._db_pool = ThreadPoolExecutor(
+            max_workers=config["telegram"].get("db_pool_size", 8), thread_name_prefix="db")
+        # ArxivClient 的论文查询与入库也走数据库线程池
+        self.arxiv_client.db_executor = self._db_pool
         self.session_manager = SessionManager(timeout=180)  # 会话超时 180 秒
+        # user_id -> (创建时间, 已发送 arxiv_id 集合)，过期后重新从数据库确认
+        self._sended_cache: Dict[int, tuple[float, set]] = {}
+        self._sended_cache_ttl = self.fetch_interval_hours * 3600
+        # 待写入数据库的 (arxiv_id, user_id) 已通知记录
+        self._notify_queue: asyncio.Queue = asyncio.Queue(maxsize=10_000)
+        self._notify_writer = None
+        # 写入任务被取消时已从队列取出、尚未写入的记录
+        self._notify_unflushed: List[tuple[str, int]] = []
+        # (arxiv_id, updated) -> 已渲染的消息，跨用户、跨轮次复用，按 LRU 淘汰
+        self._message_cache: OrderedDict[tuple[str, str], str] = OrderedDict()
+
+        # 触发 Telegram 限流（RetryAfter）时，AIORateLimiter 暂停所有请求并在等待后自动重试
+        rate_limiter = AIORateLimiter(max_retries=config["telegram"].get("flood_max_retries", 3))
 
         # Register post_init on the builder before building the Application
         builder = ApplicationBuilder()\
             .token(self.token)\
-            .rate_limiter(AIORateLimiter())\
-            .post_init(self._start_background)
+            .rate_limiter(rate_limiter)\
+            .post_init(self._start_background)\
+            .post_stop(self._stop_background)
         self.app = builder.build()
         self._register_handlers()
 
@@ -55,7 +114,7 @@ class TgBot:
 
     async def handle_set_keywords(self, update, context):
         session = self.session_manager.get_or_create(update.effective_user.id)
-        flow = SetKeywordsFlow(self.db, self.config)
+        flow = SetKeywordsFlow(self.db, self.config, run_db=self._db)
         session.flow = flow
         await flow.start(update, context, session)
 
@@ -79,93 +138,169 @@ class TgBot:
     # ---------------------------
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """处理 /start 命令，发送欢迎消息"""
-        message = f"您好！我是您的 Arxiv 机器人。\n\n本机器人会定期为您推送最新的 **Arxiv** 论文。\n您只需要设定检索式，便可以开始接收推送。当前管理员设定的抓取间隔为 6 小时。\n\n我将通过API获取检索论文并使用AI为您生成标签和摘要。 \n\n*请注意，检索式请尽量使用all字段进行组合查询，title字段可能获取不到预期的结果。*\n\n我将按照发布时间降序推送。但都是最新的论文。请不用担心时间顺序。\n以下是检索式例子：\n\n`{m2("cat:cs.CV AND (all:\"object detection\")")}`\n"
-        await update.message.reply_text(message, parse_mode="MarkdownV2")
+        await update.message.reply_text(_START_MESSAGE, parse_mode="MarkdownV2")
 
     async def show(self, update, context):
         """处理 /show 命令，显示当前用户的检索式"""
         user_id = update.effective_user.id
-        user_config = await asyncio.to_thread(self.db.get_user_config, user_id)
-        message_text = []
-        message_text.append(f"当前管理员设定的抓取间隔为 {self.fetch_interval_hours} 小时。\n\n")
+        user_config = await self._db(self.db.get_user_config, user_id)
+        header = f"当前管理员设定的抓取间隔为 {self.fetch_interval_hours} 小时。\n\n"
         try:
             if not user_config or not user_config.search_queries:
-                message_text.append(m2("您还没有设置任何检索式。使用 /set_keywords 来添加检索式。"))
+                body = m2("您还没有设置任何检索式。使用 /set_keywords 来添加检索式。")
             else:
-                existing_queries = user_config.search_queries
-                message_text.append("📋 您当前的检索式：\n\n")
-                for i, query_obj in enumerate(existing_queries, 1):
-                    message_text.append(m2(f"{i}."))
-                    message_text.append(f"`{query_obj['query']}`")
-                    message_text.append(m2(f" 最大结果: {query_obj['max_results']})\n"))
-            message = "".join(message_text)
+                body = "📋 您当前的检索式：\n\n" + format_queries(user_config.search_queries,
+                                                                markdown=True)
+            message = header + body
             await update.message.reply_text(message, parse_mode="MarkdownV2")
         except Exception as e:
             logger.error(f"Failed to show user config for {user_id}: {e}")
             await update.message.reply_text("无法加载您的配置。请稍后重试。")
 
-    async def build_message(self, p):
-        ar5iv_link = f"https://ar5iv.labs.arxiv.org/html/{m2(p.arxiv_id)}"
-        msg_lines = []
-        msg_lines.append(f"Ti: `{m2(p.title)}`")
-        msg_lines.append(f"Au: {m2(', '.join(author for author in p.authors))}")
-        msg_lines.append(f"Pu: **{m2(p.published)}**")
-        msg_lines.append("")  # 空行
-        # 如果 AI 生成了翻译
-        if p.translation:
-            msg_lines.append(f"Translation: {m2(p.translation)}")
-        # 如果 AI 生成了 tags
-        if p.tags:
-            msg_lines.append(f"Tags: {m2(', '.join(p.tags))}")
-        # 如果 AI 生成了 description
-        if p.description:
-            msg_lines.append(f"Summary: **{m2(p.description)}**")
-        msg_lines.append("")  # 空行
-        msg_lines.append(m2(f"Comment: {p.comment}"))
-        msg_lines.append(m2(f"Categories: {', '.join(p.categories)}"))
-        msg_lines.append(
-            f"Continue: [Links]({p.link}) {m2('|')} [PDF]({p.pdf_link}) {m2('|')} [Ar5iv]({ar5iv_link})"
-        )
-        msg = "\n".join(msg_lines)
+    # 链接行中的固定部分，类定义时转义一次
+    _LINK_TEMPLATE = ("Continue: [Links]({0}) " + m2("|") + " [PDF]({1}) " + m2("|") +
+                      " [Ar5iv](https://ar5iv.labs.arxiv.org/html/{2})")
+
+    def build_message(self, p):
+        # AI 生成的翻译、tags、description，缺失时省略对应行
+        translation = f"Translation: {m2(p.translation)}\n" if p.translation else ""
+        tags = f"Tags: {m2(', '.join(p.tags))}\n" if p.tags else ""
+        summary = f"Summary: **{m2(p.description)}**\n" if p.description else ""
+        comment = m2(f"Comment: {p.comment}")
+        categories = m2(f"Categories: {', '.join(p.categories)}")
+        return (f"Ti: `{m2(p.title)}`\n"
+                f"Au: {m2(', '.join(p.authors))}\n"
+                f"Pu: **{m2(p.published)}**\n\n"
+                f"{translation}{tags}{summary}\n"
+                f"{comment}\n{categories}\n"
+                f"{self._LINK_TEMPLATE.format(p.link, p.pdf_link, m2(p.arxiv_id))}")
+
+    def render_message(self, p) -> str:
+        """返回论文消息，同一论文（同一版本）只构建一次"""
+        key = (p.arxiv_id, p.updated)
+        msg = self._message_cache.get(key)
+        if msg is not None:
+            self._message_cache.move_to_end(key)
+            return msg
+        msg = self._message_cache[key] = self.build_message(p)
+        if len(self._message_cache) > MESSAGE_CACHE_SIZE:
+            self._message_cache.popitem(last=False)
         return msg
 
-    async def fetch_papers_for_query(self, user_id: int, query_text: str, max_results: int = 10):
-        """根据用户的查询式获取论文并发送给未通知过的用户"""
-        papers: List = []
-
+    async def search_papers(self, query_text: str, max_results: int = 10) -> List:
+        """根据检索式获取论文，出错时返回空列表"""
         try:
             res = await self.arxiv_client.search(query_text, max_results)
-            if isinstance(res, list):
-                papers.extend(res)
-            else:
-                logger.warning(
-                    f"arxiv_client.search returned non-list for query {query_text}: {type(res)}")
         except Exception as e:
             logger.error(f"Error fetching papers for query {query_text}: {e}")
             return []
+        if not isinstance(res, list):
+            logger.warning(
+                f"arxiv_client.search returned non-list for query {query_text}: {type(res)}")
+            return []
+        return res
 
-        # 遍历论文，检查是否已通知过该用户
-        for paper in papers:
-            try:
-                already_sended = await asyncio.to_thread(self.db.is_sended, paper.arxiv_id, user_id)
-                if already_sended:
-                    continue  # 如果已通知过该用户，跳过
+    async def send_papers(self,
+                          user_id: int,
+                          papers: List,
+                          sended_map: Dict[str, set] | None = None):
+        """将论文发送给未通知过的用户
 
-                # 构建并发送消息
-                msg = await self.build_message(paper)
+        sended_map 为本轮批量查询的 arxiv_id -> 已发送用户集合，提供时不再逐用户查询数据库。
+        """
+        if not papers:
+            return
+
+        # 筛选该用户未通知过的论文
+        try:
+            unsent = await self._filter_unsent(user_id, papers, sended_map)
+        except Exception as e:
+            logger.error(f"Failed to load sent papers for user {user_id}: {e}")
+            return
+
+        # 多篇论文合并为一条消息发送，减少 Telegram API 调用
+        messages = [(paper, self.render_message(paper)) for paper in unsent]
+        for batch, msg in self._batch_messages(messages):
+            try:
                 await self.app.bot.send_message(chat_id=user_id, text=msg, parse_mode="MarkdownV2")
+            except BadRequest as e:
+                if len(batch) == 1:
+                    logger.error(f"Failed to send paper {batch[0].arxiv_id} to user {user_id}: {e}")
+                    continue
+                # 合并消息被拒绝时逐篇重发，避免一篇论文的格式问题拖累整批
+                logger.warning(f"Batch of {len(batch)} papers rejected for user {user_id}, "
+                               f"sending one by one: {e}")
+                await self._send_one_by_one(user_id, batch)
+                continue
+            except Exception as e:
+                logger.error(f"Failed to send {len(batch)} papers to user {user_id}: {e}")
+                continue
+            await self._record_sent(user_id, batch)
 
-                # 更新数据库，记录已通知的用户
-                await asyncio.to_thread(self.db.sended, paper.arxiv_id, user_id)
+    async def _send_one_by_one(self, user_id: int, papers: List):
+        """逐篇发送论文，只记录发送成功的论文"""
+        for paper in papers:
+            try:
+                await self.app.bot.send_message(chat_id=user_id,
+                                                text=self.render_message(paper),
+                                                parse_mode="MarkdownV2")
             except Exception as e:
                 logger.error(f"Failed to send paper {paper.arxiv_id} to user {user_id}: {e}")
+                continue
+            await self._record_sent(user_id, [paper])
+
+    async def _record_sent(self, user_id: int, papers: List):
+        """已通知记录交给后台写入任务批量落库，不阻塞后续发送"""
+        self._sended_ids(user_id).update(paper.arxiv_id for paper in papers)
+        for paper in papers:
+            await self._notify_queue.put((paper.arxiv_id, user_id))
+
+    def _sended_ids(self, user_id: int) -> set:
+        """返回进程内缓存的、已确认发送给该用户的 arxiv_id 集合，过期后重建"""
+        now = time.time()
+        entry = self._sended_cache.get(user_id)
+        if entry is None or now - entry[0] > self._sended_cache_ttl:
+            entry = self._sended_cache[user_id] = (now, set())
+        return entry[1]
+
+    async def _filter_unsent(self,
+                             user_id: int,
+                             papers: List,
+                             sended_map: Dict[str, set] | None = None) -> List:
+        """筛选未发送给该用户的论文，只有缓存中未确认的 arxiv_id 才查询数据库"""
+        known = self._sended_ids(user_id)
+        if sended_map is not None:
+            return [
+                p for p in papers
+                if p.arxiv_id not in known and user_id not in sended_map.get(p.arxiv_id, ())
+            ]
+        unknown = [p.arxiv_id for p in papers if p.arxiv_id not in known]
+        if unknown:
+            known.update(await self._db(self.db.get_sended_ids, user_id, unknown))
+        return [p for p in papers if p.arxiv_id not in known]
+
+    @staticmethod
+    def _batch_messages(messages, limit: int = MESSAGE_LIMIT):
+        """将 (论文, 消息) 拼接为不超过 limit 字符的批次，逐批返回 (论文列表, 消息文本)"""
+        batch, parts, length = [], [], 0
+        for paper, msg in messages:
+            extra = len(msg) + (len(MESSAGE_SEPARATOR) if parts else 0)
+            if parts and length + extra > limit:
+                yield batch, MESSAGE_SEPARATOR.join(parts)
+                batch, parts, length = [], [], 0
+                extra = len(msg)
+            batch.append(paper)
+            parts.append(msg)
+            length += extra
+        if parts:
+            yield batch, MESSAGE_SEPARATOR.join(parts)
 
     async def fetch_now(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """根据用户的查询式获取最新论文并发送"""
         user_id = update.effective_chat.id
 
         try:
-            user_config = await asyncio.to_thread(self.db.get_user_config, user_id)
+            user_config = await self._db(self.db.get_user_config, user_id)
             search_queries = user_config.search_queries if user_config and user_config.search_queries else None
         except Exception as e:
             logger.error(f"Failed to get user config for {user_id}: {e}")
@@ -176,65 +311,145 @@ class TgBot:
             await update.message.reply_text("您没有设置检索式，请设置检索式。")
             return
 
-        # 回复用户当前的检索式
-        msg_list = []
-        msg_list.append("您一共有以下检索式：")
-        for sq in search_queries:
-            query_text = m2(sq.get("query"))
-            max_results = m2(sq.get("max_results", 10))
-            msg_list.append(f"{m2(f'-')} `{query_text}` 最大结果: {max_results}")
-        await update.message.reply_text("\n".join(msg_list),parse_mode="MarkdownV2")
-
-        # 针对每个检索式，调用 fetch_papers_for_query 处理
-        for sq in search_queries:
-            query_text = sq.get("query")
-            max_results = sq.get("max_results", 10)
-            await update.message.reply_text(f"正在根据检索式 `{m2(query_text)}` 获取最新论文",
-                                            parse_mode="MarkdownV2")
-            await self.fetch_papers_for_query(user_id, query_text, max_results)
-            await update.message.reply_text(f"该检索式的论文已全部发送。", parse_mode="MarkdownV2")
+        # 回复用户当前的检索式，之后在同一条状态消息上编辑进度，不再每个检索式单独发消息
+        header = "\n".join(["您一共有以下检索式："] + [
+            f"{DASH} `{m2(sq.get('query'))}` 最大结果: {int(sq.get('max_results', 10))}"
+            for sq in search_queries
+        ])
+        status_msg = await update.message.reply_text(f"{header}\n\n正在获取最新论文……",
+                                                     parse_mode="MarkdownV2")
+
+        # 并发获取所有检索式的论文，哪个检索式先返回就先发送哪个
+        async def search(sq):
+            return sq, await self.search_papers(sq.get("query"), sq.get("max_results", 10))
+
+        total = len(search_queries)
+        for done, next_done in enumerate(
+                asyncio.as_completed([search(sq) for sq in search_queries]), 1):
+            sq, papers = await next_done
+            await self.send_papers(user_id, papers)
+            if done < total:
+                progress = f"正在获取最新论文…… {done}/{total}\n已发送：`{m2(sq.get('query'))}`"
+            else:
+                progress = "全部检索式的论文已发送。"
+            try:
+                await status_msg.edit_text(f"{header}\n\n{progress}", parse_mode="MarkdownV2")
+            except Exception as e:
+                logger.warning(f"Failed to update fetch status for user {user_id}: {e}")
 
     # ---------------------------
     # 后台抓取任务
     # ---------------------------
-    async def _background_fetch_loop(self):
-        while True:
-            try:
-                users = await asyncio.to_thread(self.db.get_telegram_users)
-            except Exception as e:
-                logger.error(f"Failed to fetch users from DB: {e}")
-                await asyncio.sleep(1)
-                continue
-
-            if not users:
-                await asyncio.sleep(1)
-                continue
+    async def _fetch_cycle(self, context: ContextTypes.DEFAULT_TYPE):
+        """由 JobQueue 定时调度的一轮抓取与推送"""
+        try:
+            users = await self._db(self.db.get_telegram_users)
+        except Exception as e:
+            logger.error(f"Failed to fetch users from DB: {e}")
+            return
 
-            for user in users:
-                try:
-                    chat_id = user.user_id
-                    search_queries = user.search_queries or []
+        if not users:
+            return
 
-                    # 针对每个检索式执行获取论文与发送操作
-                    for sq in search_queries:
-                        query = sq.get("query")
-                        max_results = sq.get("max_results", 10)
-                        await self.fetch_papers_for_query(chat_id, query, max_results)
+        # 汇总所有用户的检索式，相同检索式只请求一次，并取最大的结果数
+        queries: Dict[str, int] = {}
+        for user in users:
+            for sq in user.search_queries or []:
+                query = sq.get("query")
+                if query:
+                    queries[query] = max(queries.get(query, 0), sq.get("max_results", 10))
+        results = await asyncio.gather(
+            *(self.search_papers(query, max_results) for query, max_results in queries.items()))
+        papers_by_query = dict(zip(queries, results))
+
+        # 一次查询本轮所有论文的发送记录，替代逐用户查询
+        arxiv_ids = list({p.arxiv_id for papers in results for p in papers})
+        try:
+            sended_map = await self._db(self.db.get_sended_map, arxiv_ids)
+        except Exception as e:
+            logger.error(f"Failed to load sent records, falling back to per-user lookups: {e}")
+            sended_map = None
+
+        # 各用户的发送相互独立，并发处理，信号量限制同时处理的用户数
+        sem = asyncio.Semaphore(self.config["telegram"].get("user_concurrency", 16))
+        await asyncio.gather(*(self._process_user(user, papers_by_query, sended_map, sem)
+                               for user in users),
+                             return_exceptions=True)
+
+    async def _process_user(self, user, papers_by_query: Dict[str, List],
+                            sended_map: Dict[str, set] | None, sem: asyncio.Semaphore):
+        """将本轮检索结果发送给单个用户"""
+        async with sem:
+            try:
+                chat_id = user.user_id
+                search_queries = user.search_queries or []
 
-                except Exception as e:
-                    logger.error(f"Error fetching papers for user {user.user_id}: {e}")
-                    continue
+                # 针对每个检索式，从本轮结果中截取该用户的最大结果数并发送
+                for sq in search_queries:
+                    papers = papers_by_query.get(sq.get("query"), [])
+                    await self.send_papers(chat_id, papers[:sq.get("max_results", 10)],
+                                           sended_map)
 
-            await asyncio.sleep(self.fetch_interval_hours * 3600)
+            except Exception as e:
+                logger.error(f"Error fetching papers for user {user.user_id}: {e}")
 
     # ---------------------------
     # 启动机器人
     # ---------------------------
     async def _start_background(self, app):
-        """在事件循环中创建后台抓取任务"""
-        # create_task will schedule the background loop on the application's event loop
-        # app.create_task(self._background_fetch_loop())
-        asyncio.create_task(self._background_fetch_loop())
+        """在事件循环中注册后台定时抓取任务"""
+        self.session_manager.attach_bot(app.bot)
+        self._notify_writer = asyncio.create_task(self._notify_writer_loop())
+        if app.job_queue is None:
+            logger.error("JobQueue unavailable, install python-telegram-bot[job-queue]")
+            return
+        app.job_queue.run_repeating(self._fetch_cycle,
+                                    interval=self.fetch_interval_hours * 3600,
+                                    first=1)
+
+    async def _stop_background(self, app):
+        """停止后台写入任务，并写入队列中剩余的已通知记录"""
+        self.session_manager.stop()
+        if self._notify_writer:
+            self._notify_writer.cancel()
+            try:
+                await self._notify_writer
+            except asyncio.CancelledError:
+                pass
+        remaining, self._notify_unflushed = self._notify_unflushed, []
+        while not self._notify_queue.empty():
+            remaining.append(self._notify_queue.get_nowait())
+        await self._flush_notify(remaining)
+        self._db_pool.shutdown(wait=False)
+        aclose = getattr(self.arxiv_client, "aclose", None)
+        if aclose:
+            await aclose()
+
+    async def _notify_writer_loop(self):
+        """批量写入已通知记录：攒够 500 条或等待 100ms 后写入一次"""
+        while True:
+            batch = [await self._notify_queue.get()]
+            try:
+                await asyncio.sleep(0.1)
+                while not self._notify_queue.empty() and len(batch) < 500:
+                    batch.append(self._notify_queue.get_nowait())
+                await self._flush_notify(batch)
+            except asyncio.CancelledError:
+                # 已取出但未确认写入的记录交给 _stop_background 补写，重复写入会被忽略
+                self._notify_unflushed = batch
+                raise
+
+    def _db(self, fn, *args):
+        """在数据库线程池中执行同步数据库调用"""
+        return asyncio.get_running_loop().run_in_executor(self._db_pool, fn, *args)
+
+    async def _flush_notify(self, records: List[tuple[str, int]]):
+        if not records:
+            return
+        try:
+            await self._db(self.db.sended_many, records)
+        except Exception as e:
+            logger.error(f"Failed to record {len(records)} sent papers: {e}")
 
     def run(self):
         """启动机器人（同步）
@@ -242,24 +457,48 @@ class TgBot:
         PTB 的 Application.run_polling() 是同步入口点；`arxiv_main.py` 以同步方式调用 bot.run()
         因此这里使用同步包装，避免调用者需要管理事件循环。
         """
-        self.app.run_polling()
+        try:
+            import uvloop  # 可选依赖，安装后替换默认事件循环
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            logger.info("Using uvloop event loop")
+        except ImportError:
+            pass
+        tg_cfg = self.config["telegram"]
+        webhook_url = tg_cfg.get("webhook_url")
+        if webhook_url:
+            # Webhook 模式：由 Telegram 主动推送更新，无需持续轮询 getUpdates
+            self.app.run_webhook(listen=tg_cfg.get("webhook_listen", "0.0.0.0"),
+                                 port=tg_cfg.get("webhook_port", 8443),
+                                 url_path=self.token,
+                                 webhook_url=f"{webhook_url.rstrip('/')}/{self.token}")
+        else:
+            # 长轮询：getUpdates 在服务端挂起直到有更新或超时，空闲时大幅减少请求数
+            self.app.run_polling(timeout=tg_cfg.get("long_poll_timeout", 20))
 
 
 class UserSession:
     """管理单个用户的会话状态和交互消息"""
 
+    # 会话数量随用户增长，固定属性省去每个实例的 __dict__
+    __slots__ = ("user_id", "state", "tmp_data", "_messages_to_revoke", "timeout", "last_active",
+                 "manager", "flow", "_expire_handle")
+
     def __init__(self, user_id: int, timeout: int = 180):
         self.user_id = user_id
         self.state: str | None = None
+        self.flow = None  # 当前进行中的交互 Flow
         self.tmp_data: Dict[str, Any] = {}
         self._messages_to_revoke: List[Dict[str, int]] = []
         self.timeout = timeout
         self.last_active = time.time()
         self.manager = None  # 在创建时注入
+        self._expire_handle: asyncio.TimerHandle | None = None
 
     def touch(self):
-        """刷新活动时间"""
+        """刷新活动时间，并重新计时超时"""
         self.last_active = time.time()
+        if self.manager:
+            self.manager.schedule_expire(self)
 
     def add_revoke_message(self, message):
         """记录需要撤回的消息"""
@@ -275,13 +514,28 @@ class UserSession:
                 self._messages_to_revoke.append(message)
 
     async def revoke_messages(self, bot):
-        """撤回交互消息"""
-        for msg in list(self._messages_to_revoke):
-            try:
-                await bot.delete_message(chat_id=msg["chat_id"], message_id=msg["message_id"])
-            except Exception as e:
+        """撤回交互消息，同一聊天的消息用一次 deleteMessages 批量删除"""
+        messages, self._messages_to_revoke = self._messages_to_revoke, []
+        if not messages:
+            return
+        by_chat: Dict[int, List[int]] = {}
+        for msg in messages:
+            by_chat.setdefault(msg["chat_id"], []).append(msg["message_id"])
+
+        if not hasattr(bot, "delete_messages"):
+            # 旧版 PTB 没有 delete_messages，退回逐条并发删除
+            results = await asyncio.gather(
+                *(bot.delete_message(chat_id=msg["chat_id"], message_id=msg["message_id"])
+                  for msg in messages),
+                return_exceptions=True)
+        else:
+            results = await asyncio.gather(
+                *(bot.delete_messages(chat_id=chat_id, message_ids=message_ids)
+                  for chat_id, message_ids in by_chat.items()),
+                return_exceptions=True)
+        for e in results:
+            if isinstance(e, Exception):
                 logger.debug(f"撤回消息失败: {e}")
-        self._messages_to_revoke.clear()
 
     def reset(self):
         """重置内部状态"""
@@ -296,12 +550,13 @@ class UserSession:
             self.manager.remove(self.user_id)
 
     async def on_expire(self, bot):
-        """由 Manager 触发的超时清理"""
+        """由 Manager 触发的超时清理，只有进行中的操作才提示用户"""
         await self.revoke_messages(bot)
-        try:
-            await bot.send_message(chat_id=self.user_id, text="⚠️ 操作超时，已自动取消。")
-        except Exception as e:
-            logger.debug(f"发送超时提示失败: {e}")
+        if self.state is not None:
+            try:
+                await bot.send_message(chat_id=self.user_id, text="⚠️ 操作超时，已自动取消。")
+            except Exception as e:
+                logger.debug(f"发送超时提示失败: {e}")
         self.reset()
         
     def _initialize_flow(self):
@@ -313,28 +568,22 @@ class UserSession:
 class SessionManager:
     """统一管理所有会话生命周期"""
 
-    def __init__(self, timeout: int = 180, check_interval: float = 2.0):
+    def __init__(self, timeout: int = 180):
         self.timeout = timeout
-        self.check_interval = check_interval
         self._sessions: Dict[int, UserSession] = {}
-        self._watchdog_task = None
-        self._running = False
+        self._expire_tasks: set[asyncio.Task] = set()
         self.bot = None
 
     def attach_bot(self, bot):
         """启动前注入 bot 实例"""
         self.bot = bot
 
-    def start(self):
-        """启动超时检测任务"""
-        if not self._running:
-            self._running = True
-            self._watchdog_task = asyncio.create_task(self._watchdog_loop())
-
     def stop(self):
-        self._running = False
-        if self._watchdog_task:
-            self._watchdog_task.cancel()
+        """取消所有未触发的超时计时"""
+        for session in self._sessions.values():
+            if session._expire_handle:
+                session._expire_handle.cancel()
+                session._expire_handle = None
 
     def get_or_create(self, user_id: int) -> UserSession:
         session = self._sessions.get(user_id)
@@ -348,29 +597,31 @@ class SessionManager:
 
     def remove(self, user_id: int):
         """被 session.end() 调用"""
-        if user_id in self._sessions:
-            del self._sessions[user_id]
+        session = self._sessions.pop(user_id, None)
+        if session is not None:
+            if session._expire_handle:
+                session._expire_handle.cancel()
+                session._expire_handle = None
             logger.info(f"移除会话: {user_id}")
 
-    async def _watchdog_loop(self):
-        logger.info("Session 超时检测启动")
-        try:
-            while self._running:
-                now = time.time()
-                expired = []
-                for uid, s in list(self._sessions.items()):
-                    if now - s.last_active > s.timeout:
-                        expired.append(s)
-
-                for s in expired:
-                    logger.info(f"会话超时: {s.user_id}")
-                    if self.bot:
-                        asyncio.create_task(self._handle_expire(s))
-                await asyncio.sleep(self.check_interval)
-        except asyncio.CancelledError:
-            pass
-        except Exception:
-            logger.exception("SessionManager 出错")
+    def schedule_expire(self, session: UserSession):
+        """会话每次活动后重新设置超时回调，无活动时不做任何轮询"""
+        if session._expire_handle:
+            session._expire_handle.cancel()
+        session._expire_handle = asyncio.get_running_loop().call_later(
+            session.timeout, self._expire, session)
+
+    def _expire(self, session: UserSession):
+        session._expire_handle = None
+        if self._sessions.get(session.user_id) is not session:
+            return
+        logger.info(f"会话超时: {session.user_id}")
+        if not self.bot:
+            self.remove(session.user_id)
+            return
+        task = asyncio.create_task(self._handle_expire(session))
+        self._expire_tasks.add(task)
+        task.add_done_callback(self._expire_tasks.discard)
 
     async def _handle_expire(self, session: UserSession):
         try:
@@ -381,25 +632,61 @@ class SessionManager:
 class SetKeywordsFlow:
     """处理 /set_keywords 命令的完整交互流程"""
 
-    def __init__(self, db, config):
+    def __init__(self, db, config, run_db=None):
         self.db = db
         self.config = config
+        # 执行同步数据库调用的方式，TgBot 传入其数据库线程池，未提供时使用默认线程池
+        self._run_db = run_db or asyncio.to_thread
+
+    async def _get_queries(self, session, user_id: int) -> list:
+        """读取会话中缓存的检索式快照，缺失时从数据库加载"""
+        queries = session.tmp_data.get("queries")
+        if queries is None:
+            user_cfg = await self._run_db(self.db.get_user_config, user_id)
+            queries = list(user_cfg.search_queries) if user_cfg and user_cfg.search_queries else []
+            self._set_queries(session, queries)
+        return queries
+
+    @staticmethod
+    def _set_queries(session, queries: list | None):
+        """更新会话中的检索式快照，同时使已渲染的列表文本和查重集合失效"""
+        session.tmp_data.pop("queries_text", None)
+        session.tmp_data.pop("query_set", None)
+        if queries is None:
+            session.tmp_data.pop("queries", None)
+        else:
+            session.tmp_data["queries"] = queries
+
+    @staticmethod
+    def _queries_text(session, queries: list) -> str:
+        """渲染检索式列表，同一快照只渲染一次"""
+        text = session.tmp_data.get("queries_text")
+        if text is None:
+            text = session.tmp_data["queries_text"] = format_queries(queries)
+        return text
+
+    @staticmethod
+    def _query_set(session, queries: list) -> set:
+        """检索式文本集合，用于查重，同一快照只构建一次"""
+        query_set = session.tmp_data.get("query_set")
+        if query_set is None:
+            query_set = session.tmp_data["query_set"] = {q["query"] for q in queries}
+        return query_set
 
     async def start(self, update, context, session):
         user_id = update.effective_user.id
-        user_cfg = await asyncio.to_thread(self.db.get_user_config, user_id)
+        self._set_queries(session, None)
+        queries = await self._get_queries(session, user_id)
         session.touch()
 
-        if not user_cfg or not user_cfg.search_queries:
+        if not queries:
             msg = await update.message.reply_text("您还没有设置任何检索式，请输入要添加的检索式：")
             session.state = "ADDING_KEYWORD"
             session.add_revoke_message(msg)
             return
 
         # 用户已有检索式
-        text = "📋 当前检索式：\n\n"
-        for i, q in enumerate(user_cfg.search_queries, 1):
-            text += f"{i}. {q['query']} (最大结果: {q['max_results']})\n"
+        text = "📋 当前检索式：\n\n" + self._queries_text(session, queries)
 
         keyboard = [[
             InlineKeyboardButton("➕ 新增", callback_data="add_keyword"),
@@ -430,15 +717,13 @@ class SetKeywordsFlow:
             return
 
         if query.data == "delete_keyword":
-            user_cfg = await asyncio.to_thread(self.db.get_user_config, user_id)
-            if not user_cfg or not user_cfg.search_queries:
+            queries = await self._get_queries(session, user_id)
+            if not queries:
                 await query.edit_message_text("您还没有设置检索式。")
                 await session.end(context.bot)
                 return
 
-            text = "请输入要删除的编号：\n"
-            for i, q in enumerate(user_cfg.search_queries, 1):
-                text += f"{i}. {q['query']} (最大结果: {q['max_results']})\n"
+            text = "请输入要删除的编号：\n" + self._queries_text(session, queries)
             msg = await query.edit_message_text(text)
             session.state = "DELETING_KEYWORD"
             session.add_revoke_message(msg)
@@ -471,18 +756,21 @@ class SetKeywordsFlow:
                     return
 
                 kw = session.tmp_data["new_keyword"]
-                user_cfg = await asyncio.to_thread(self.db.get_user_config, user_id)
-                queries = user_cfg.search_queries if user_cfg and user_cfg.search_queries else []
-                if any(q["query"] == kw for q in queries):
+                queries = await self._get_queries(session, user_id)
+                if kw in self._query_set(session, queries):
                     await update.message.reply_text("该检索式已存在，请重新输入。")
                     session.state = "ADDING_KEYWORD"
                     return
 
-                queries.append({"query": kw, "max_results": max_results})
-                await asyncio.to_thread(self.db.insert_or_update_user, user_id, {
-                    "search_queries": queries,
-                    "platform": "telegram"
-                })
+                query_obj = {"query": kw, "max_results": max_results}
+                added = await self._run_db(self.db.append_search_query, user_id, query_obj,
+                                           "telegram")
+                if not added:
+                    self._set_queries(session, None)  # 快照已过期，下次重新加载
+                    await update.message.reply_text("该检索式已存在，请重新输入。")
+                    session.state = "ADDING_KEYWORD"
+                    return
+                self._set_queries(session, queries + [query_obj])
                 await update.message.reply_text(f"✅ 添加成功：{kw}（最大结果 {max_results}）")
                 await session.end(context.bot)
             except ValueError:
@@ -493,14 +781,15 @@ class SetKeywordsFlow:
         if session.state == "DELETING_KEYWORD":
             try:
                 idx = int(text) - 1
-                user_cfg = await asyncio.to_thread(self.db.get_user_config, user_id)
-                queries = user_cfg.search_queries if user_cfg and user_cfg.search_queries else []
+                queries = await self._get_queries(session, user_id)
                 if 0 <= idx < len(queries):
-                    deleted = queries.pop(idx)
-                    await asyncio.to_thread(self.db.insert_or_update_user, user_id, {
+                    deleted = queries[idx]
+                    queries = queries[:idx] + queries[idx + 1:]
+                    await self._run_db(self.db.insert_or_update_user, user_id, {
                         "search_queries": queries,
                         "platform": "telegram"
                     })
+                    self._set_queries(session, queries)
                     await update.message.reply_text(f"🗑 已删除：{deleted['query']}")
                     await session.end(context.bot)
                 else: